@@ -24,22 +24,25 @@ def calcola_average_levered_beta_settoriale(paesi_di_interesse):
         # Caricamento del foglio di lavoro specifico che contiene i dati per paese.
         # Il foglio si chiama 'Country'
         # L'opzione header=6 indica che l'intestazione della tabella si trova alla settima riga.
-        df = pd.read_excel(url, sheet_name='Country', header=6)
+        # Con usecols vengono lette solo le colonne di nostro interesse.
+        colonne_utili = ['Country', 'Industry Name', 'Levered Beta']
+        df = pd.read_excel(url, sheet_name='Country', header=6, engine='calamine', usecols=colonne_utili)
 
-        # Pulizia dei dati: Rimuoviamo righe e colonne non necessarie.
-        # Rimuoviamo le righe che contengono valori nulli nelle colonne chiave
-        df.dropna(subset=['Country', 'Industry Name', 'Levered Beta'], inplace=True)
+        # Filtriamo subito il DataFrame per includere solo i paesi di nostro interesse:
+        # la pulizia successiva lavora solo sulle poche righe rimaste
+        df_filtrato = df[df['Country'].isin(set(paesi_di_interesse))]
 
-        # Selezioniamo solo le colonne di nostro interesse
-        colonne_utili = ['Country', 'Industry Name', 'Levered Beta']
-        df = df[colonne_utili]
+        # Pulizia dei dati: Rimuoviamo le righe che contengono valori nulli nelle colonne chiave
+        # (Country è già valorizzato per tutte le righe filtrate)
+        df_filtrato = df_filtrato.dropna(subset=['Industry Name', 'Levered Beta'])
 
-        # Filtriamo il DataFrame per includere solo i paesi di nostro interesse
-        df_filtrato = df[df['Country'].isin(paesi_di_interesse)]
+        # Paese e settore come categorie: il groupby lavora su codici interi
+        df_filtrato = df_filtrato.astype({'Country': 'category', 'Industry Name': 'category'})
 
         # Raggruppiamo per Paese e Settore e calcoliamo la media del Levered Beta
         # Questo passaggio è fondamentale se un settore avesse più voci per un paese.
-        risultato = df_filtrato.groupby(['Country', 'Industry Name'])['Levered Beta'].mean().reset_index()
+        # observed=True evita il prodotto cartesiano di tutte le categorie.
+        risultato = df_filtrato.groupby(['Country', 'Industry Name'], observed=True)['Levered Beta'].mean().reset_index()
 
         # Rinominiamo la colonna per chiarezza
         risultato.rename(columns={'Levered Beta': 'Average Levered Beta'}, inplace=True)
@@ -0,0 +1,242 @@
+# Funzioni condivise per scaricare e leggere i dataset beta di Aswath Damodaran (NYU Stern)
+# Usate da beta_settoriale.py e beta-analysis-script.py: stessa sessione HTTP,
+# stessa cache su disco e stesso parsing dei fogli Excel, così un file già
+# scaricato da uno script non viene riscaricato né interpretato diversamente dall'altro.
+import io
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import tempfile
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+import numpy as np
+import pandas as pd
+
+BASE_CURRENT = "https://pages.stern.nyu.edu/~adamodar/pc/datasets/"
+BASE_ARCH    = "https://pages.stern.nyu.edu/~adamodar/pc/archives/"
+
+# Mappa "geografia Damodaran" -> prefisso file
+# Nota: "US" usa "betas.xls" (senza suffisso); per archivi usa betasYY.xls
+GEOGRAPHY_FILE = {
+    "US":       {"current": "betas.xls",        "arch_fmt": "betas{yy}.xls"},
+    "Europe":   {"current": "betaEurope.xls",   "arch_fmt": "betaEurope{yy}.xls"},
+    "Japan":    {"current": "betaJapan.xls",    "arch_fmt": "betaJapan{yy}.xls"},
+    "Global":   {"current": "betaGlobal.xls",   "arch_fmt": "betaGlobal{yy}.xls"},
+    "Emerging": {"current": "betaemerg.xls",    "arch_fmt": "betaemerg{yy}.xls"},
+    "India":    {"current": "betaIndia.xls",    "arch_fmt": "betaIndia{yy}.xls"},
+    "China":    {"current": "indregChina.xls",  "arch_fmt": "indregChina{yy}.xls"},  # (betaChina non sempre presente)
+    "Rest":     {"current": "betaRest.xls",     "arch_fmt": "betaRest{yy}.xls"},     # Aus/NZ/Canada in Damodaran = "Rest" nei dataset
+}
+
+# Schema canonico dei fogli beta: colonne numeriche, percentuali e sempre float
+NUMERIC_COLUMNS = ["Number of firms", "Beta", "D/E Ratio", "Effective Tax rate",
+                   "Unlevered beta", "Cash/Firm value", "Unlevered beta corrected for cash"]
+PERCENT_COLUMNS = ["D/E Ratio", "Effective Tax rate", "Cash/Firm value"]
+# Number of firms resta intero; le colonne percentuali possono contenere "%"
+FLOAT_COLUMNS = {"Beta", "Unlevered beta", "Unlevered beta corrected for cash"}
+CANONICAL_COLUMNS = ["Industry Name", *NUMERIC_COLUMNS]
+
+# Numero massimo di download simultanei (il lavoro è I/O-bound, non CPU-bound)
+MAX_WORKERS = 8
+
+# Sessione HTTP condivisa: connessioni keep-alive riutilizzate tra download (anche in parallelo)
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+CHUNK_SIZE = 1 << 20
+
+# Cache su disco dei file scaricati: gli archivi degli anni passati non cambiano mai,
+# i file "current" vengono rivalidati con GET condizionale (ETag / Last-Modified)
+CACHE_DIR = Path.home() / ".cache" / "damodaran_betas"
+ARCHIVE_RE = re.compile(r"/archives/.*\d{2}\.xls$")
+# Un archivio non pubblicato (404) viene ricontrollato dopo questo intervallo (secondi)
+NOT_FOUND_TTL = 7 * 24 * 3600
+
+
+def year_to_yy(year: int) -> str:
+    # nei file d'archivio Damodaran usa spesso due cifre (es. 2023 -> 23)
+    return str(year)[-2:]
+
+
+def damodaran_url(geo: str, year: Optional[int] = None) -> str:
+    meta = GEOGRAPHY_FILE[geo]
+    if year is None:
+        return BASE_CURRENT + meta["current"]
+    return BASE_ARCH + meta["arch_fmt"].format(yy=year_to_yy(year))
+
+
+def _read_body(r: requests.Response) -> bytes:
+    # Legge la risposta in streaming a blocchi da 1 MiB
+    buf = io.BytesIO()
+    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+        buf.write(chunk)
+    return buf.getvalue()
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    # Scrive su un file temporaneo nella stessa cartella e lo rinomina: un'esecuzione
+    # interrotta o parallela non lascia mai in cache un file troncato
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _read_meta(meta_path: Path) -> dict:
+    # Un .meta mancante o corrotto equivale a un cache miss
+    try:
+        meta = json.loads(meta_path.read_text())
+    except (OSError, ValueError):
+        return {}
+    return meta if isinstance(meta, dict) else {}
+
+
+def cached_get(url: str, cache_dir: Optional[Path] = CACHE_DIR) -> bytes:
+    """
+    Scarica url e ne restituisce il contenuto, passando per la cache su disco
+    in cache_dir (None disabilita la cache).
+    """
+    if cache_dir is None:
+        with _SESSION.get(url, timeout=30, stream=True) as r:
+            r.raise_for_status()
+            return _read_body(r)
+
+    cache_dir = Path(cache_dir)
+    data_path = cache_dir / hashlib.sha1(url.encode()).hexdigest()
+    meta_path = data_path.with_suffix(".meta")
+    meta = _read_meta(meta_path)
+    is_archive = ARCHIVE_RE.search(url) is not None
+
+    if is_archive:
+        if data_path.exists():
+            return data_path.read_bytes()
+        if meta.get("status") == 404 and time.time() - meta.get("checked", 0) < NOT_FOUND_TTL:
+            raise requests.HTTPError(f"404 Client Error: Not Found for url: {url} (da cache)")
+
+    headers = {}
+    if data_path.exists() and meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    with _SESSION.get(url, headers=headers, timeout=30, stream=True) as r:
+        if r.status_code == 304 and data_path.exists():
+            return data_path.read_bytes()
+        content = _read_body(r) if r.ok else b""
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        if r.status_code == 404 and is_archive:
+            # Anno/geo non pubblicato: memorizziamo il 404 per non riprovare fino a NOT_FOUND_TTL
+            _write_atomic(meta_path, json.dumps({"url": url, "status": 404, "checked": time.time()}).encode())
+        elif r.ok:
+            _write_atomic(data_path, content)
+            _write_atomic(meta_path, json.dumps({
+                "url": url,
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+            }).encode())
+    except OSError as e:
+        # La cache è un'ottimizzazione: se non scrivibile proseguiamo senza
+        print(f"[WARN] Cache non scrivibile ({cache_dir}): {e}", file=sys.stderr)
+    r.raise_for_status()
+    return content
+
+
+def fetch_all(urls: List[str],
+              max_workers: int = MAX_WORKERS,
+              cache_dir: Optional[Path] = CACHE_DIR) -> Dict[str, bytes]:
+    """
+    Scarica in parallelo i file indicati e restituisce {url: contenuto}.
+    Gli URL non scaricabili sono segnalati con un warning e omessi dal risultato.
+    """
+    contents = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        futures = {ex.submit(cached_get, url, cache_dir): url for url in urls}
+        for fut in as_completed(futures):
+            url = futures[fut]
+            try:
+                contents[url] = fut.result()
+            except Exception as e:
+                # Se un file d'archivio non esiste per quell'anno/geo, salta con warning
+                print(f"[WARN] Errore nel leggere {url}: {e}", file=sys.stderr)
+    return contents
+
+
+def parse_damodaran(content: bytes) -> pd.DataFrame:
+    """
+    Interpreta un foglio beta Damodaran e restituisce le righe settoriali
+    con le colonne dello schema canonico presenti nel file, già numeriche.
+    Solleva ValueError se l'intestazione "Industry Name" non viene trovata.
+    """
+    xl = pd.ExcelFile(io.BytesIO(content), engine="calamine")
+
+    # Cerca la riga che contiene "Industry Name" scorrendo le righe in streaming:
+    # ci si ferma all'intestazione senza caricare l'intero foglio in un DataFrame
+    header_row = None
+    for idx, row in enumerate(xl.book.get_sheet_by_index(0).iter_rows()):
+        if any("Industry Name" in str(val) for val in row):
+            header_row = idx
+            header = row
+            break
+    if header_row is None:
+        raise ValueError("Intestazione 'Industry Name' non trovata nel foglio")
+
+    # Colonne beta sempre numeriche: tipo imposto in lettura, senza inferenza
+    dtype_map = {str(col): "float64" for col in header if str(col).strip() in FLOAT_COLUMNS}
+
+    # Leggi il foglio una sola volta, partendo dalla riga di intestazione
+    # e materializzando solo le colonne dello schema canonico
+    usecols = lambda col: str(col).strip() in CANONICAL_COLUMNS
+    try:
+        df = xl.parse(sheet_name=0, skiprows=header_row, usecols=usecols, dtype=dtype_map)
+    except ValueError:
+        # Celle non numeriche (es. note in fondo alla tabella): si lascia l'inferenza a pandas
+        df = xl.parse(sheet_name=0, skiprows=header_row, usecols=usecols)
+
+    # Pulisci i nomi delle colonne
+    df.columns = [str(col).strip() for col in df.columns]
+
+    # Filtra le righe valide (rimuovi intestazioni ripetute e totali) con un'unica
+    # maschera calcolata dai kernel stringa di NumPy sull'array dei nomi
+    names = df["Industry Name"].to_numpy()
+    names_str = names.astype(str)
+    valid = (pd.notna(names)
+             & (names_str != "Industry Name")
+             & (np.char.find(np.char.lower(names_str), "total market") < 0))
+    df = df[valid]
+
+    # Converti le colonne numeriche
+    present = [col for col in NUMERIC_COLUMNS if col in df.columns]
+
+    # Gestisci percentuali (converte "15.5%" in 15.5) su tutte le colonne testuali in un colpo:
+    # .str agisce solo sulle stringhe, le celle già numeriche vengono ripristinate con fillna;
+    # le colonne object rimaste senza stringhe (es. dopo aver tolto le intestazioni ripetute) si saltano
+    obj_cols = [col for col in present if df[col].dtype == "object"
+                and pd.api.types.infer_dtype(df[col]) in ("string", "mixed", "mixed-integer")]
+    if obj_cols:
+        df[obj_cols] = df[obj_cols].apply(lambda s: s.str.rstrip("%").fillna(s))
+    df[present] = df[present].apply(pd.to_numeric, errors="coerce")
+
+    # Se sembra essere una percentuale (valori > 1), dividi per 100
+    pct_cols = [col for col in PERCENT_COLUMNS if col in df.columns]
+    if pct_cols:
+        maxes = df[pct_cols].max()
+        df[pct_cols] = df[pct_cols].div(np.where(maxes > 1, 100, 1), axis=1)
+
+    # Nomi dei settori come categorie (meno memoria, filtri e groupby più rapidi)
+    df["Industry Name"] = df["Industry Name"].astype("category")
+    return df.reset_index(drop=True)
+
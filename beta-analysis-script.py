@@ -5,14 +5,22 @@
 # Versione: 1.0
 # Elaborato da Perplexity AI
 
+from pathlib import Path
 import pandas as pd
 import numpy as np
-import requests
-from io import BytesIO
 from datetime import datetime
 import warnings
 warnings.filterwarnings('ignore')
 
+try:
+    # Opzionale: ricerca multi-settore in un solo passaggio (pip install pyahocorasick)
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Download, cache e parsing dei fogli Damodaran condivisi con beta_settoriale.py
+from _loader import CACHE_DIR, fetch_all, parse_damodaran
+
 class DamodaranBetaAnalyzer:
     """
     Classe per analizzare e calcolare Average Levered Beta settoriali 
@@ -27,8 +35,26 @@ class DamodaranBetaAnalyzer:
     - Rest (Australia, Nuova Zelanda, Canada)
     """
     
-    def __init__(self):
+    # Colonne Damodaran -> colonne dell'analisi di settore
+    ANALYSIS_COLUMNS = {
+        'Industry Name': 'Sector',
+        'Region': 'Region',
+        'Number of firms': 'Number_of_Firms',
+        'Beta': 'Beta_Levered_Original',
+        'D/E Ratio': 'DE_Ratio_Original',
+        'Effective Tax rate': 'Tax_Rate_Original',
+        'Unlevered beta': 'Beta_Unlevered',
+        'Unlevered beta corrected for cash': 'Beta_Unlevered_Cash_Adjusted'
+    }
+    
+    def __init__(self, cache_dir=CACHE_DIR):
         self.datasets = {}
+        # Dataset di tutte le regioni concatenati (costruito su richiesta)
+        self._combined = None
+        # Settori disponibili per regione e complessivi (costruiti su richiesta)
+        self._sector_index = None
+        # Cartella per la cache dei file scaricati (None disabilita la cache)
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
         self.urls = {
             'USA': 'https://pages.stern.nyu.edu/~adamodar/pc/datasets/betas.xls',
             'Europe': 'https://pages.stern.nyu.edu/~adamodar/pc/datasets/betaEurope.xls', 
@@ -38,9 +64,10 @@ class DamodaranBetaAnalyzer:
             'Rest': 'https://pages.stern.nyu.edu/~adamodar/pc/datasets/betaRest.xls'
         }
         
-    def load_data(self, regions=None, verbose=True):
+    def load_data(self, regions=None, verbose=True, max_workers=8):
         """
         Carica i dati dei beta settoriali da Damodaran per le regioni specificate.
+        I download vengono eseguiti in parallelo, il parsing in sequenza.
         
         Parameters:
         -----------
@@ -48,6 +75,8 @@ class DamodaranBetaAnalyzer:
             Lista delle regioni da caricare. Se None, carica tutte.
         verbose : bool, optional 
             Se True, stampa messaggi di debug durante il caricamento.
+        max_workers : int, optional
+            Numero massimo di download simultanei (default: 8).
         
         Returns:
         --------
@@ -59,29 +88,34 @@ class DamodaranBetaAnalyzer:
         if verbose:
             print(f"Caricamento dati Damodaran per: {', '.join(regions)}")
         
+        valid_regions = []
         for region in regions:
             if region not in self.urls:
                 if verbose:
                     print(f"Regione {region} non disponibile")
                 continue
-                
-            try:
+            valid_regions.append(region)
+        
+        # Scarica i file Excel in parallelo (operazione I/O-bound), passando per la cache su disco;
+        # i download falliti sono segnalati da fetch_all e omessi dal risultato
+        if verbose:
+            for region in valid_regions:
+                print(f"Scaricando dati per {region}...")
+        contents = fetch_all([self.urls[region] for region in valid_regions],
+                             max_workers=max_workers, cache_dir=self.cache_dir)
+        
+        for region in valid_regions:
+            if self.urls[region] not in contents:
                 if verbose:
-                    print(f"Scaricando dati per {region}...")
-                
-                # Scarica il file Excel
-                response = requests.get(self.urls[region], timeout=30)
-                response.raise_for_status()
-                
+                    print(f"✗ Download non riuscito per {region}")
+                continue
+            try:
                 # Leggi il file Excel
-                excel_file = BytesIO(response.content)
-                
-                # Prova diversi approcci per leggere il file
-                df = self._parse_excel_file(excel_file, region)
+                df = self._parse_excel_file(contents[self.urls[region]], region)
                 
                 if df is not None and not df.empty:
                     # Aggiungi colonna regione
-                    df['Region'] = region
+                    df['Region'] = pd.Categorical([region] * len(df))
                     self.datasets[region] = df
                     
                     if verbose:
@@ -94,63 +128,38 @@ class DamodaranBetaAnalyzer:
                 if verbose:
                     print(f"✗ Errore nel caricamento per {region}: {e}")
         
+        # I dataset sono cambiati: DataFrame combinato e indice dei settori vanno ricostruiti
+        self._combined = None
+        self._sector_index = None
+        
         if verbose:
             print(f"\nDataset caricati con successo: {list(self.datasets.keys())}")
         
         return self.datasets
         
-    def _parse_excel_file(self, excel_file, region):
+    def _parse_excel_file(self, content, region):
         """
-        Metodo interno per parsare i file Excel di Damodaran.
+        Metodo interno per parsare i file Excel di Damodaran (contenuto binario scaricato).
         Gestisce le diverse strutture dei fogli Excel.
         """
         try:
-            # Leggi tutto il file per trovare la struttura
-            df_full = pd.read_excel(excel_file, sheet_name=0, header=None)
-            
-            # Cerca la riga che contiene "Industry Name"
-            header_row = None
-            for idx, row in df_full.iterrows():
-                row_str = ' '.join([str(val) for val in row.values if pd.notna(val)])
-                if 'Industry Name' in row_str:
-                    header_row = idx
-                    break
-            
-            if header_row is not None:
-                # Rileggi con le intestazioni corrette
-                excel_file.seek(0)
-                df = pd.read_excel(excel_file, sheet_name=0, skiprows=header_row)
-                
-                # Pulisci i nomi delle colonne
-                df.columns = [str(col).strip() for col in df.columns]
-                
-                # Filtra le righe valide
-                df = df[df['Industry Name'].notna() & 
-                       (df['Industry Name'] != 'Industry Name') &
-                       (~df['Industry Name'].astype(str).str.contains('Total Market', na=False))]
-                
-                # Converti le colonne numeriche
-                numeric_cols = ['Number of firms', 'Beta', 'D/E Ratio', 'Effective Tax rate', 
-                              'Unlevered beta', 'Cash/Firm value', 'Unlevered beta corrected for cash']
-                
-                for col in numeric_cols:
-                    if col in df.columns:
-                        # Gestisci percentuali (converte "15.5%" in 0.155)
-                        if df[col].dtype == 'object':
-                            df[col] = df[col].astype(str).str.rstrip('%').replace('nan', np.nan)
-                        df[col] = pd.to_numeric(df[col], errors='coerce')
-                        
-                        # Se sembra essere una percentuale (valori > 1), dividi per 100
-                        if col in ['D/E Ratio', 'Effective Tax rate', 'Cash/Firm value'] and df[col].max() > 1:
-                            df[col] = df[col] / 100
-                
-                return df
-                
+            return parse_damodaran(content)
         except Exception as e:
             print(f"Errore nel parsing per {region}: {e}")
             return None
         
-        return None
+    def _get_combined(self):
+        """
+        Metodo interno: restituisce i dataset di tutte le regioni concatenati
+        in un unico DataFrame, costruito una sola volta dopo load_data().
+        """
+        if self._combined is None:
+            combined = pd.concat(self.datasets.values(), ignore_index=True)
+            # concat di categorie diverse produce object: riunifichiamo le categorie
+            for col in ['Industry Name', 'Region']:
+                combined[col] = combined[col].astype('category')
+            self._combined = combined
+        return self._combined
         
     def get_sector_beta(self, sector_name, regions=None, exact_match=False):
         """
@@ -173,28 +182,18 @@ class DamodaranBetaAnalyzer:
             print("Nessun dataset caricato. Usa load_data() prima.")
             return pd.DataFrame()
         
-        if regions is None:
-            regions = list(self.datasets.keys())
-        
-        results = []
+        df = self._get_combined()
+        if regions is not None:
+            df = df[df['Region'].isin(regions)]
         
-        for region in regions:
-            if region not in self.datasets:
-                continue
-                
-            df = self.datasets[region]
-            
-            if exact_match:
-                matches = df[df['Industry Name'].str.lower() == sector_name.lower()]
-            else:
-                matches = df[df['Industry Name'].str.contains(sector_name, case=False, na=False)]
-            
-            if not matches.empty:
-                results.append(matches)
+        # Un solo filtro vettoriale su tutte le regioni (ricerca substring semplice, senza regex)
+        if exact_match:
+            matches = df[df['Industry Name'].str.lower() == sector_name.lower()]
+        else:
+            matches = df[df['Industry Name'].str.contains(sector_name, case=False, na=False, regex=False)]
         
-        if results:
-            combined = pd.concat(results, ignore_index=True)
-            return combined
+        if not matches.empty:
+            return matches.reset_index(drop=True)
         else:
             print(f"Settore '{sector_name}' non trovato nelle regioni specificate")
             return pd.DataFrame()
@@ -220,6 +219,32 @@ class DamodaranBetaAnalyzer:
         """
         return unlevered_beta * (1 + (1 - target_tax_rate) * target_de_ratio)
     
+    def _build_sector_analysis(self, sector_data, target_de_ratio=None, target_tax_rate=None):
+        """
+        Metodo interno: trasforma le righe Damodaran nello schema dell'analisi
+        di settore e, se forniti i parametri target, calcola il beta levered target.
+        """
+        # Rinomina le colonne Damodaran nello schema di output (NaN se la colonna manca)
+        result = pd.DataFrame({
+            out_col: sector_data[src_col] if src_col in sector_data.columns else np.nan
+            for src_col, out_col in self.ANALYSIS_COLUMNS.items()
+        }).reset_index(drop=True)
+        
+        # Calcola beta levered con parametri target se forniti
+        if target_de_ratio is not None and target_tax_rate is not None:
+            # Usa beta unlevered corretto per cash se disponibile
+            unlevered = result['Beta_Unlevered_Cash_Adjusted'].fillna(result['Beta_Unlevered'])
+            has_unlevered = unlevered.notna()
+            
+            if has_unlevered.any():
+                result['Beta_Levered_Target'] = self.calculate_levered_beta(
+                    unlevered, target_de_ratio, target_tax_rate
+                )
+                result['DE_Ratio_Target'] = np.where(has_unlevered, target_de_ratio, np.nan)
+                result['Tax_Rate_Target'] = np.where(has_unlevered, target_tax_rate, np.nan)
+        
+        return result
+        
     def analyze_sector(self, sector_name, target_de_ratio=None, target_tax_rate=None, regions=None):
         """
         Analizza un settore e calcola l'average levered beta per diverse regioni.
@@ -244,36 +269,7 @@ class DamodaranBetaAnalyzer:
         if sector_data.empty:
             return pd.DataFrame()
         
-        results = []
-        
-        for _, row in sector_data.iterrows():
-            result = {
-                'Sector': row['Industry Name'],
-                'Region': row['Region'],
-                'Number_of_Firms': row.get('Number of firms', np.nan),
-                'Beta_Levered_Original': row.get('Beta', np.nan),
-                'DE_Ratio_Original': row.get('D/E Ratio', np.nan),
-                'Tax_Rate_Original': row.get('Effective Tax rate', np.nan),
-                'Beta_Unlevered': row.get('Unlevered beta', np.nan),
-                'Beta_Unlevered_Cash_Adjusted': row.get('Unlevered beta corrected for cash', np.nan)
-            }
-            
-            # Calcola beta levered con parametri target se forniti
-            if target_de_ratio is not None and target_tax_rate is not None:
-                # Usa beta unlevered corretto per cash se disponibile
-                unlevered = row.get('Unlevered beta corrected for cash', 
-                                   row.get('Unlevered beta', np.nan))
-                
-                if not pd.isna(unlevered):
-                    result['Beta_Levered_Target'] = self.calculate_levered_beta(
-                        unlevered, target_de_ratio, target_tax_rate
-                    )
-                    result['DE_Ratio_Target'] = target_de_ratio
-                    result['Tax_Rate_Target'] = target_tax_rate
-            
-            results.append(result)
-        
-        return pd.DataFrame(results)
+        return self._build_sector_analysis(sector_data, target_de_ratio, target_tax_rate)
     
     def calculate_weighted_average_beta(self, sector_analysis, weight_col='Number_of_Firms', beta_col=None):
         """
@@ -362,16 +358,59 @@ class DamodaranBetaAnalyzer:
             print("Nessun dataset caricato.")
             return []
         
-        sectors = []
+        if self._sector_index is None:
+            # Indice calcolato una sola volta: settori ordinati per regione e totali (chiave None)
+            self._sector_index = {
+                name: sorted(set(df['Industry Name'].tolist()))
+                for name, df in self.datasets.items()
+            }
+            self._sector_index[None] = sorted(set().union(*self._sector_index.values()))
         
         if region and region in self.datasets:
-            sectors = self.datasets[region]['Industry Name'].tolist()
+            return list(self._sector_index[region])
+        return list(self._sector_index[None])
+    
+    def _match_sectors(self, industry_names, sector_names):
+        """
+        Metodo interno: trova le coppie (settore cercato, riga) in cui il nome del
+        settore compare, senza distinzione di maiuscole, nell'Industry Name.
+        
+        Con pyahocorasick installato tutti i nomi vengono cercati in un solo
+        passaggio sulla colonna; altrimenti si esegue una str.contains per settore.
+        
+        Returns:
+        --------
+        tuple : (indici in sector_names, posizioni di riga), ordinati per settore e riga
+        """
+        patterns = [str(sector).lower() for sector in sector_names]
+        lowered = industry_names.str.lower()
+        
+        if ahocorasick is not None and all(patterns):
+            positions = {}
+            for i, pattern in enumerate(patterns):
+                positions.setdefault(pattern, []).append(i)
+            
+            automaton = ahocorasick.Automaton()
+            for pattern in positions:
+                automaton.add_word(pattern, pattern)
+            automaton.make_automaton()
+            
+            pairs = set()
+            for row, name in enumerate(lowered.to_numpy()):
+                if isinstance(name, str):
+                    for _, pattern in automaton.iter(name):
+                        pairs.update((i, row) for i in positions[pattern])
+            pairs = sorted(pairs)
         else:
-            for df in self.datasets.values():
-                sectors.extend(df['Industry Name'].tolist())
+            pairs = [(i, row)
+                     for i, pattern in enumerate(patterns)
+                     for row in np.flatnonzero(lowered.str.contains(pattern, na=False, regex=False))]
+        
+        if not pairs:
+            return np.array([], dtype=int), np.array([], dtype=int)
+        sector_idx, rows = np.array(pairs, dtype=int).T
+        return sector_idx, rows
         
-        return sorted(list(set(sectors)))
-    
     def compare_sectors(self, sector_names, target_de_ratio=None, target_tax_rate=None, regions=None):
         """
         Confronta i beta di più settori.
@@ -391,27 +430,59 @@ class DamodaranBetaAnalyzer:
         --------
         pd.DataFrame : Confronto dei settori con average beta
         """
-        comparison_results = []
-        
-        for sector in sector_names:
-            analysis = self.analyze_sector(
-                sector, 
-                target_de_ratio=target_de_ratio,
-                target_tax_rate=target_tax_rate,
-                regions=regions
-            )
-            
-            if not analysis.empty:
-                avg_beta = self.calculate_weighted_average_beta(analysis)
-                
-                comparison_results.append({
-                    'Sector': sector,
-                    'Average_Levered_Beta': avg_beta,
-                    'Regions_Count': len(analysis),
-                    'Total_Firms': analysis['Number_of_Firms'].sum() if 'Number_of_Firms' in analysis.columns else np.nan
-                })
-        
-        return pd.DataFrame(comparison_results).sort_values('Average_Levered_Beta', ascending=False)
+        columns = ['Sector', 'Average_Levered_Beta', 'Regions_Count', 'Total_Firms']
+        if not self.datasets:
+            print("Nessun dataset caricato. Usa load_data() prima.")
+            return pd.DataFrame(columns=columns)
+        
+        df = self._get_combined()
+        if regions is not None:
+            df = df[df['Region'].isin(regions)]
+        
+        # Righe di ciascun settore richiesto (stessa ricerca substring di get_sector_beta),
+        # etichettate con la posizione in sector_names: una riga può corrispondere a più settori
+        # e un nome ripetuto resta una voce distinta del confronto
+        sector_idx, rows = self._match_sectors(df['Industry Name'], sector_names)
+        found = set(sector_idx.tolist())
+        for i, sector in enumerate(sector_names):
+            if i not in found:
+                print(f"Settore '{sector}' non trovato nelle regioni specificate")
+        
+        if not found:
+            return pd.DataFrame(columns=columns)
+        
+        sub = df.iloc[rows].reset_index(drop=True)
+        analysis = self._build_sector_analysis(sub, target_de_ratio, target_tax_rate)
+        analysis['Query'] = sector_idx
+        
+        # Come calculate_weighted_average_beta: per ogni settore usa il beta target
+        # se disponibile in almeno una riga, altrimenti quello originale
+        beta = analysis['Beta_Levered_Original']
+        if 'Beta_Levered_Target' in analysis.columns:
+            has_target = analysis['Beta_Levered_Target'].notna().groupby(analysis['Query']).transform('any')
+            beta = analysis['Beta_Levered_Target'].where(has_target, beta)
+        
+        # Media ponderata per numero aziende sulle righe con beta e peso validi
+        valid = beta.notna() & analysis['Number_of_Firms'].notna()
+        weights = analysis['Number_of_Firms'].where(valid, 0)
+        analysis['w'] = weights
+        analysis['bw'] = beta.where(valid, 0) * weights
+        analysis['b'] = beta.where(valid)
+        
+        agg = (analysis
+               .groupby('Query', sort=False)
+               .agg(sum_bw=('bw', 'sum'),
+                    sum_w=('w', 'sum'),
+                    mean_b=('b', 'mean'),
+                    Regions_Count=('Query', 'size'),
+                    Total_Firms=('Number_of_Firms', 'sum')))
+        
+        # Se non ci sono pesi validi, usa media semplice
+        agg['Average_Levered_Beta'] = (agg['sum_bw'] / agg['sum_w']).where(agg['sum_w'] > 0, agg['mean_b'])
+        
+        agg['Sector'] = np.asarray(sector_names, dtype=object)[agg.index.to_numpy()]
+        comparison = agg.reset_index(drop=True)[columns]
+        return comparison.sort_values('Average_Levered_Beta', ascending=False)
 
 # =============================================================================
 # ESEMPIO DI UTILIZZO
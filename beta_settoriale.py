@@ -1,7 +1,6 @@
 # Script Python per calcolare Average Levered Beta settoriali
 # Utilizzando i database di Aswath Damodaran (NYU Stern)
 # Elaborato da ChatGPT-5
-import io
 import sys
 import math
 import time
@@ -9,105 +8,123 @@ import json
 import zipfile
 from dataclasses import dataclass
 from typing import List, Dict, Tuple
-import requests
+import numpy as np
 import pandas as pd
 
-BASE_CURRENT = "https://pages.stern.nyu.edu/~adamodar/pc/datasets/"
-BASE_ARCH    = "https://pages.stern.nyu.edu/~adamodar/pc/archives/"
+# Download, cache e parsing dei fogli Damodaran condivisi con beta-analysis-script.py
+from _loader import damodaran_url, fetch_all, parse_damodaran
 
-# Mappa "geografia Damodaran" -> prefisso file
-# Nota: "US" usa "betas.xls" (senza suffisso); per archivi usa betasYY.xls
-GEOGRAPHY_FILE = {
-    "US":       {"current": "betas.xls",        "arch_fmt": "betas{yy}.xls"},
-    "Europe":   {"current": "betaEurope.xls",   "arch_fmt": "betaEurope{yy}.xls"},
-    "Japan":    {"current": "betaJapan.xls",    "arch_fmt": "betaJapan{yy}.xls"},
-    "Global":   {"current": "betaGlobal.xls",   "arch_fmt": "betaGlobal{yy}.xls"},
-    "Emerging": {"current": "betaemerg.xls",    "arch_fmt": "betaemerg{yy}.xls"},
-    "India":    {"current": "betaIndia.xls",    "arch_fmt": "betaIndia{yy}.xls"},
-    "China":    {"current": "indregChina.xls",  "arch_fmt": "indregChina{yy}.xls"},  # (betaChina non sempre presente; vedi nota sotto)
-    "Rest":     {"current": "betaRest.xls",     "arch_fmt": "betaRest{yy}.xls"},     # Aus/NZ/Canada in Damodaran = "Rest" nei dataset
-}
+try:
+    # Opzionale: kernel compilato per la media ponderata (pip install numba)
+    from numba import njit
+except ImportError:
+    njit = None
 
-# Alcuni anni/regioni potrebbero non avere il file; gestiamo con fallback
-def fetch_excel(url: str) -> pd.DataFrame:
-    r = requests.get(url, timeout=30)
-    r.raise_for_status()
-    return pd.read_excel(io.BytesIO(r.content), engine="xlrd")
-
-def year_to_yy(year: int) -> str:
-    # nei file d'archivio Damodaran usa spesso due cifre (es. 2023 -> 23)
-    return str(year)[-2:]
-
-def load_damodaran_betas(geo: str, year: int) -> pd.DataFrame:
-    meta = GEOGRAPHY_FILE[geo]
-    if year is None:
-        url = BASE_CURRENT + meta["current"]
-    else:
-        url = BASE_ARCH + meta["arch_fmt"].format(yy=year_to_yy(year))
+def parse_damodaran_betas(content: bytes, geo: str, year: int, url: str) -> pd.DataFrame:
     try:
-        df = fetch_excel(url)
-        # Normalizziamo i nomi colonne più usati
-        cols = {c: c.strip() for c in df.columns}
-        df.rename(columns=cols, inplace=True)
+        df = parse_damodaran(content)
         # Le intestazioni tipiche: "Industry Name", "Number of firms", "Beta", "D/E Ratio", "Tax rate" / "Effective Tax rate" ...
-        # Filtra righe valide
-        for col in ["Industry Name", "Beta"]:
+        for col in ["Industry Name", "Beta", "Number of firms"]:
             if col not in df.columns:
                 raise KeyError(f"Colonna {col} non trovata in {url}")
-        # Rimuovi totali e righe non settoriali, se presenti
-        mask_valid = df["Industry Name"].astype(str).str.lower().str.contains("total market") == False
-        df = df.loc[mask_valid].copy()
         df["Year"] = year
-        df["Geography"] = geo
-        # Harmonize numero aziende
-        nf_col = "Number of firms" if "Number of firms" in df.columns else None
-        if nf_col:
-            df["Number of firms"] = pd.to_numeric(df[nf_col], errors="coerce")
-        # Beta levered
-        df["Beta"] = pd.to_numeric(df["Beta"], errors="coerce")
+        # Etichette come categorie: groupby su codici interi e meno memoria
+        df["Geography"] = pd.Categorical([geo] * len(df))
         return df[["Industry Name", "Beta", "Number of firms", "Year", "Geography"]]
     except Exception as e:
         raise RuntimeError(f"Errore nel leggere {url}: {e}")
 
+if njit is not None:
+    @njit(cache=True)
+    def _weighted_sums(codes, beta, weights, n_groups):
+        # Un solo passaggio sui dati: somma di beta*peso e dei pesi per gruppo, ignorando i beta mancanti
+        num = np.zeros(n_groups)
+        den = np.zeros(n_groups)
+        for i in range(codes.shape[0]):
+            if not np.isnan(beta[i]):
+                num[codes[i]] += beta[i] * weights[i]
+                den[codes[i]] += weights[i]
+        return num, den
+else:
+    _weighted_sums = None
+
 def compute_average_beta(geos: List[str],
                          start_year: int,
                          end_year: int,
                          weight_by_firms: bool = False) -> pd.DataFrame:
+    # Download in parallelo di tutti i file, parsing sequenziale sui byte ricevuti
+    tasks = [(geo, y, damodaran_url(geo, y))
+             for geo in geos
+             for y in range(start_year, end_year + 1)]
+    contents = fetch_all([url for _, _, url in tasks])
+
     frames = []
-    for geo in geos:
-        for y in range(start_year, end_year + 1):
-            try:
-                frames.append(load_damodaran_betas(geo, y))
-            except RuntimeError as err:
-                # Se un file d'archivio non esiste per quell'anno/geo, salta con warning
-                print(f"[WARN] {err}", file=sys.stderr)
-                continue
+    for geo, y, url in tasks:
+        if url not in contents:
+            continue
+        try:
+            frames.append((geo, parse_damodaran_betas(contents[url], geo, y, url)))
+        except RuntimeError as err:
+            print(f"[WARN] {err}", file=sys.stderr)
+            continue
     if not frames:
         raise RuntimeError("Nessun dataset caricato. Controlla geografie e anni.")
 
-    data = pd.concat(frames, ignore_index=True)
-    # Aggregazione per settore & geografia
-    def agg_fun(g):
-        if not weight_by_firms:
-            avg_beta = g["Beta"].mean(skipna=True)
-        else:
-            w = g["Number of firms"].fillna(0)
-            b = g["Beta"].fillna(pd.NA)
-            if w.sum() > 0:
-                avg_beta = (b * w).sum(skipna=True) / w.where(~b.isna(), 0).sum()
-            else:
-                avg_beta = b.mean(skipna=True)
-        # statistica accessoria
-        return pd.Series({
-            "AvgLeveredBeta": avg_beta,
-            "YearsObs": g["Year"].nunique(),
-            "AvgFirms": g["Number of firms"].mean(skipna=True)
-        })
+    # Schema fisso: preallochiamo le colonne e copiamo ogni frame nella sua fetta,
+    # evitando pd.concat e la re-inferenza dei dtype
+    n_rows = sum(len(df) for _, df in frames)
+    geo_names = sorted({geo for geo, _ in frames})
+    industry = np.empty(n_rows, dtype=object)
+    beta = np.empty(n_rows, dtype=np.float64)
+    firms = np.empty(n_rows, dtype=np.float64)
+    year = np.empty(n_rows, dtype=np.int16)
+    geo_codes = np.empty(n_rows, dtype=np.int8)
+    start = 0
+    for geo, df in frames:
+        end = start + len(df)
+        industry[start:end] = df["Industry Name"].to_numpy(dtype=object)
+        beta[start:end] = df["Beta"].to_numpy(dtype=np.float64)
+        firms[start:end] = df["Number of firms"].to_numpy(dtype=np.float64)
+        year[start:end] = df["Year"].to_numpy()
+        geo_codes[start:end] = geo_names.index(geo)
+        start = end
 
-    out = (data
-           .groupby(["Geography", "Industry Name"], as_index=False)
-           .apply(agg_fun)
-           .reset_index(drop=True))
+    data = pd.DataFrame({
+        "Industry Name": pd.Categorical(industry),
+        "Beta": beta,
+        "Number of firms": firms,
+        "Year": year,
+        "Geography": pd.Categorical.from_codes(geo_codes, categories=geo_names),
+    })
+    # Aggregazione per settore & geografia (groupby vettoriale, nessuna funzione Python per gruppo)
+    keys = ["Geography", "Industry Name"]
+    if not weight_by_firms:
+        out = (data
+               .groupby(keys, as_index=False, observed=True)
+               .agg(AvgLeveredBeta=("Beta", "mean"),
+                    YearsObs=("Year", "nunique"),
+                    AvgFirms=("Number of firms", "mean")))
+    else:
+        # Peso = numero aziende, azzerato dove il beta manca (non entra né al numeratore né al denominatore)
+        w = data["Number of firms"].fillna(0).where(data["Beta"].notna(), 0)
+        grouped = data.groupby(keys, as_index=False, observed=True)
+        out = grouped.agg(BetaMean=("Beta", "mean"),
+                          YearsObs=("Year", "nunique"),
+                          AvgFirms=("Number of firms", "mean"))
+        if _weighted_sums is not None:
+            # ngroup() numera i gruppi nello stesso ordine delle righe di out
+            out["bw"], out["w"] = _weighted_sums(grouped.ngroup().to_numpy(np.int64),
+                                                 data["Beta"].to_numpy(np.float64),
+                                                 w.to_numpy(np.float64),
+                                                 len(out))
+        else:
+            sums = (data.assign(w=w, bw=data["Beta"] * w)
+                    .groupby(keys, observed=True)[["bw", "w"]]
+                    .sum())
+            out["bw"] = sums["bw"].to_numpy()
+            out["w"] = sums["w"].to_numpy()
+        # Se i pesi sono tutti nulli si ripiega sulla media semplice
+        out["AvgLeveredBeta"] = (out["bw"] / out["w"]).where(out["w"] > 0, out["BetaMean"])
 
     out["StartYear"] = start_year
     out["EndYear"] = end_year
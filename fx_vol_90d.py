@@ -4,51 +4,110 @@
 # Utilizzando i dati pubblici di FRED (Federal Reserve Economic Data)
 
 import io
+import os
 import sys
+import json
+import math
 import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
 
 import pandas as pd
 import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+
+# pyarrow è opzionale: se presente il CSV viene letto dal parser C++ multithread
+# e la cache locale usa parquet, altrimenti pandas e pickle
+try:
+    import pyarrow
+    import pyarrow.csv as pacsv
+except ImportError:
+    pyarrow = pacsv = None
 
 
 # DEXUSEU = U.S. Dollars per One Euro  -> USD/EUR (autoritativo e daily)
 # DEXJPUS = Japanese Yen per One U.S. Dollar -> JPY/USD (autoritativo e daily)
 FRED_URL_TEMPLATE = "https://fred.stlouisfed.org/graph/fredgraph.csv?id={series_id}"
 
+# Cache locale delle serie già pulite, rivalidata con GET condizionale (ETag / Last-Modified)
+CACHE_DIR = Path.home() / ".cache" / "fx_vol"
+CACHE_SUFFIX = ".parquet" if pyarrow is not None else ".pkl"
+
+# Sessione HTTP condivisa: connessioni keep-alive riutilizzate tra i download FRED (DEXJPUS + DEXUSEU);
+# le risposte arrivano compresse (requests invia già "Accept-Encoding: gzip, deflate")
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=2))
+
+
+def _read_cached_series(path: Path, series_id: str) -> pd.Series:
+    if path.suffix == ".parquet":
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_pickle(path)
+    return df[series_id]
+
+
+def _replace_atomic(path: Path, write) -> None:
+    # write() scrive su un file temporaneo nella stessa cartella, poi rinominato su path:
+    # un'esecuzione interrotta non lascia in cache file troncati
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
 
-def fetch_fred_series(series_id: str) -> pd.Series:
+def _write_cached_series(path: Path, series: pd.Series) -> None:
+    df = series.to_frame()
+    if path.suffix == ".parquet":
+        _replace_atomic(path, lambda tmp: df.to_parquet(tmp, engine="pyarrow", compression="snappy"))
+    else:
+        _replace_atomic(path, df.to_pickle)
+
+
+def _drop_cache(*paths: Path) -> None:
+    for path in paths:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+def _parse_fred_csv(content: bytes, series_id: str) -> pd.Series:
     """
-    Scarica la serie da FRED in formato CSV pubblico e restituisce una Series con DateTimeIndex.
+    Interpreta il CSV FRED (byte grezzi, senza decodifica in str) e restituisce
+    la serie pulita (date valide, valori numerici, ordinata).
     """
-    url = FRED_URL_TEMPLATE.format(series_id=series_id)
-    resp = requests.get(url, timeout=30)
-    resp.raise_for_status()
-
-    content_type = resp.headers.get("Content-Type", "")
-    if "csv" not in content_type.lower():
-        sample = resp.text[:200].replace("\n", " ")
-        raise ValueError(
-            f"Risposta inattesa da FRED (content-type: {content_type!r}, sample: {sample!r})"
+    # FRED indica i valori mancanti con "."
+    if pacsv is not None:
+        table = pacsv.read_csv(
+            pyarrow.BufferReader(content),
+            convert_options=pacsv.ConvertOptions(null_values=["."], strings_can_be_null=True),
         )
-
-    df = pd.read_csv(io.StringIO(resp.text))
+        df = table.to_pandas(date_as_object=False, coerce_temporal_nanoseconds=True)
+    else:
+        df = pd.read_csv(io.BytesIO(content), na_values=["."])
     df.columns = [col.strip() for col in df.columns]
-    lowered = {col.lower(): col for col in df.columns}
+    # Schema FRED noto: colonna data + colonna col nome della serie
+    cols = {col.upper(): col for col in df.columns}
 
-    date_key = lowered.get("date") or lowered.get("observation_date")
+    date_key = cols.get("DATE") or cols.get("OBSERVATION_DATE")
     if not date_key:
         raise ValueError(
             f"Colonna data non trovata nel CSV FRED. Colonne disponibili: {list(df.columns)}"
         )
 
-    value_key = None
-    series_id_lower = series_id.lower()
-    for key, original in lowered.items():
-        if key.startswith(series_id_lower):
-            value_key = original
-            break
+    value_key = cols.get(series_id.upper())
     if not value_key:
         # Fallback: try to find any column that is not the date column
         potential_values = [col for col in df.columns if col != date_key]
@@ -60,8 +119,9 @@ def fetch_fred_series(series_id: str) -> pd.Series:
             )
 
     df = df.rename(columns={date_key: "DATE", value_key: "VALUE"})
-    df["DATE"] = pd.to_datetime(df["DATE"], errors="coerce", utc=True).dt.tz_convert(None)
-    df["VALUE"] = pd.to_numeric(df["VALUE"].replace(".", np.nan), errors="coerce")
+    # Le date FRED sono ISO senza fuso orario: formato fisso, nessuna localizzazione UTC
+    df["DATE"] = pd.to_datetime(df["DATE"], format="%Y-%m-%d", errors="coerce", cache=True)
+    df["VALUE"] = pd.to_numeric(df["VALUE"], errors="coerce")
     df = df.dropna(subset=["DATE", "VALUE"]).sort_values("DATE")
 
     if df.empty:
@@ -70,29 +130,143 @@ def fetch_fred_series(series_id: str) -> pd.Series:
     return pd.Series(df["VALUE"].values, index=df["DATE"], name=series_id)
 
 
+def fetch_fred_series(series_id: str, cache_dir: Optional[Path] = CACHE_DIR) -> pd.Series:
+    """
+    Scarica la serie da FRED in formato CSV pubblico e restituisce una Series con DateTimeIndex.
+    Se il server fornisce ETag/Last-Modified la serie pulita viene salvata in cache_dir
+    (None disabilita la cache) e, finché FRED risponde 304, riletta da disco senza riscaricare
+    né reinterpretare il CSV.
+    """
+    url = FRED_URL_TEMPLATE.format(series_id=series_id)
+
+    headers = {}
+    if cache_dir is not None:
+        cache_dir = Path(cache_dir)
+        data_path = cache_dir / f"{series_id}{CACHE_SUFFIX}"
+        meta_path = cache_dir / f"{series_id}.meta"
+        if data_path.exists() and meta_path.exists():
+            try:
+                meta = json.loads(meta_path.read_text())
+                if not isinstance(meta, dict):
+                    raise ValueError("formato .meta non valido")
+            except (OSError, ValueError):
+                # .meta corrotto: scartiamo la voce di cache e riscarichiamo senza validatori
+                _drop_cache(data_path, meta_path)
+                meta = {}
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+    resp = _SESSION.get(url, headers=headers, timeout=30)
+    if resp.status_code == 304 and headers:
+        try:
+            return _read_cached_series(data_path, series_id)
+        except Exception:
+            # Copia su disco illeggibile: la scartiamo e riscarichiamo la serie completa
+            _drop_cache(data_path, meta_path)
+            resp = _SESSION.get(url, timeout=30)
+    resp.raise_for_status()
+
+    content_type = resp.headers.get("Content-Type", "")
+    if "csv" not in content_type.lower():
+        sample = resp.text[:200].replace("\n", " ")
+        raise ValueError(
+            f"Risposta inattesa da FRED (content-type: {content_type!r}, sample: {sample!r})"
+        )
+
+    series = _parse_fred_csv(resp.content, series_id)
+
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+    if cache_dir is not None and (etag or last_modified):
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            _write_cached_series(data_path, series)
+            meta = json.dumps({"url": url, "etag": etag, "last_modified": last_modified})
+            _replace_atomic(meta_path, lambda tmp: Path(tmp).write_text(meta))
+        except OSError as e:
+            # La cache è un'ottimizzazione: se non scrivibile proseguiamo senza
+            print(f"[WARN] Cache non scrivibile ({cache_dir}): {e}", file=sys.stderr)
+
+    return series
+
+
+def _rolling_stdev_log_returns(logp, window):
+    # Media e somma degli scarti quadratici aggiornate in O(1) a ogni passo (Welford con
+    # sostituzione del rendimento uscente): l'intera curva costa O(n) invece di O(n * window)
+    n = logp.shape[0]
+    out = np.empty(n - window)
+    mean = 0.0
+    m2 = 0.0
+    for k in range(window):
+        r = logp[k + 1] - logp[k]
+        delta = r - mean
+        mean += delta / (k + 1)
+        m2 += delta * (r - mean)
+    out[0] = math.sqrt(m2 / (window - 1))
+    for i in range(window + 1, n):
+        r_new = logp[i] - logp[i - 1]
+        r_old = logp[i - window] - logp[i - window - 1]
+        delta = r_new - r_old
+        old_mean = mean
+        mean += delta / window
+        m2 += delta * (r_new - mean + r_old - old_mean)
+        out[i - window] = math.sqrt(max(m2, 0.0) / (window - 1))
+    return out
+
+
+_rolling_kernel = None
+
+
+def _get_rolling_kernel():
+    """
+    Kernel numba compilato per _rolling_stdev_log_returns, o None se numba non è installato.
+    numba è importato solo qui: per la singola finestra di main l'import e la compilazione
+    costerebbero più del calcolo NumPy (pip install numba).
+    """
+    global _rolling_kernel
+    if _rolling_kernel is None:
+        try:
+            from numba import njit
+        except ImportError:
+            _rolling_kernel = False
+        else:
+            _rolling_kernel = njit(cache=True)(_rolling_stdev_log_returns)
+    return _rolling_kernel or None
+
+
 def compute_annualized_vol(series: pd.Series, window: int = 90, trading_days: int = 252):
     """
     Calcola volatilità storica annualizzata su 'window' rendimenti giornalieri logaritmici.
+    La serie deve essere già pulita (senza NaN, come quella di fetch_fred_series): le ultime
+    window+1 osservazioni sono usate così come sono e un NaN tra queste solleva ValueError.
     Ritorna dict con risultati principali.
     """
-    # Rendimenti logaritmici giornalieri
-    rets = np.log(series / series.shift(1)).dropna()
-
-    if len(rets) < window:
+    # Serie pulita: n prezzi danno n-1 rendimenti
+    n_rets = max(len(series) - 1, 0)
+    if n_rets < window:
         raise ValueError(
-            f"Osservazioni insufficienti ({len(rets)}) per una finestra di {window} rendimenti."
+            f"Osservazioni insufficienti ({n_rets}) per una finestra di {window} rendimenti."
         )
 
-    # Prendi gli ultimi 'window' rendimenti disponibili
-    last_rets = rets.iloc[-window:]
-    stdev_daily = last_rets.std(ddof=1)  # sample stdev
+    # Rendimenti logaritmici giornalieri, calcolati solo sugli ultimi window+1 prezzi.
+    # Il calcolo legge ogni prezzo una volta sola (limitato dalla memoria, non dal calcolo):
+    # istruzioni SIMD non aiuterebbero, e i dati restano float64 perché la deviazione
+    # standard di rendimenti dell'ordine di 1e-3 perderebbe cifre significative in float32
+    prices = series.to_numpy(dtype=np.float64)[-(window + 1):]
+    if np.isnan(prices).any():
+        raise ValueError(
+            f"La serie contiene valori mancanti (NaN) nelle ultime {window + 1} osservazioni."
+        )
+    stdev_daily = np.diff(np.log(prices)).std(ddof=1)  # sample stdev
     vol_annualized = stdev_daily * np.sqrt(trading_days)
 
     out = {
         "window": window,
-        "obs_count": int(last_rets.shape[0]),
-        "start_date": last_rets.index[0].date().isoformat(),
-        "end_date": last_rets.index[-1].date().isoformat(),
+        "obs_count": window,
+        "start_date": series.index[-window].date().isoformat(),
+        "end_date": series.index[-1].date().isoformat(),
         "last_spot_date": series.index[-1].date().isoformat(),
         "last_spot": float(series.iloc[-1]),
         "stdev_daily": float(stdev_daily),
@@ -102,6 +276,32 @@ def compute_annualized_vol(series: pd.Series, window: int = 90, trading_days: in
     return out
 
 
+def compute_rolling_vol(series: pd.Series, window: int = 90, trading_days: int = 252) -> pd.Series:
+    """
+    Curva della volatilità storica annualizzata su finestre mobili di 'window' rendimenti
+    logaritmici giornalieri (utile per confrontare più finestre o più cambi).
+    Ritorna una Series indicizzata per data dell'ultimo rendimento di ogni finestra.
+    """
+    if window < 2:
+        raise ValueError(f"La finestra deve contenere almeno 2 rendimenti (ricevuto {window}).")
+    n_rets = max(len(series) - 1, 0)
+    if n_rets < window:
+        raise ValueError(
+            f"Osservazioni insufficienti ({n_rets}) per una finestra di {window} rendimenti."
+        )
+
+    kernel = _get_rolling_kernel()
+    if kernel is not None:
+        logp = np.log(series.to_numpy(dtype=np.float64))
+        stdev_daily = kernel(logp, window)
+    else:
+        rets = np.log(series.astype(np.float64)).diff()
+        stdev_daily = rets.rolling(window).std(ddof=1).to_numpy()[window:]
+
+    return pd.Series(stdev_daily * np.sqrt(trading_days), index=series.index[window:],
+                     name=f"vol_annualized_{trading_days}")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Volatilità storica a 90 giorni del cambio USD/EUR o JPY/EUR (Dati FRED)."
@@ -145,16 +345,17 @@ def main():
             # Note: DEXJPUS is JPY per USD. DEXUSEU is USD per EUR.
             # So JPY per EUR = (JPY/USD) * (USD/EUR) = DEXJPUS * DEXUSEU
             print("Scaricamento dati JPY (DEXJPUS) e USD (DEXUSEU)...")
-            s_jpy_usd = fetch_fred_series("DEXJPUS")
-            s_usd_eur = fetch_fred_series("DEXUSEU")
+            # I due download sono indipendenti e I/O-bound: in parallelo
+            with ThreadPoolExecutor(max_workers=2) as ex:
+                f_jpy_usd = ex.submit(fetch_fred_series, "DEXJPUS")
+                f_usd_eur = ex.submit(fetch_fred_series, "DEXUSEU")
+                s_jpy_usd, s_usd_eur = f_jpy_usd.result(), f_usd_eur.result()
             
-            # Align series on common dates
-            df_aligned = pd.concat([s_jpy_usd, s_usd_eur], axis=1, join="inner")
-            df_aligned.columns = ["DEXJPUS", "DEXUSEU"]
+            # Align series on common dates (senza costruire un DataFrame intermedio)
+            jpy_usd, usd_eur = s_jpy_usd.align(s_usd_eur, join="inner")
             
             # Calculate JPY/EUR
-            series = df_aligned["DEXJPUS"] * df_aligned["DEXUSEU"]
-            series.name = "JPY_per_EUR"
+            series = pd.Series(jpy_usd.to_numpy() * usd_eur.to_numpy(), index=jpy_usd.index, name="JPY_per_EUR")
             currency_pair_name = "JPY/EUR"
             
     except Exception as e:
@@ -192,13 +393,13 @@ def main():
 
     # 4) (opzionale) salvataggio CSV con i dati usati
     if args.save_csv:
-        df = series.to_frame(name="RATE")
-        df["log_return"] = np.log(series / series.shift(1))
-        # Filtra il periodo usato per la finestra calcolata
-        mask = (df.index.date >= pd.to_datetime(res["start_date"]).date()) & (
-            df.index.date <= pd.to_datetime(res["end_date"]).date()
+        # Solo il periodo usato per la finestra: gli ultimi window+1 prezzi bastano per
+        # i rendimenti, senza ricalcolarli sull'intera serie
+        prices = series.to_numpy(dtype=np.float64)[-(res["window"] + 1):]
+        df_used = pd.DataFrame(
+            {"RATE": prices[1:], "log_return": np.log(prices[1:] / prices[:-1])},
+            index=series.index[-res["window"]:],
         )
-        df_used = df.loc[mask].copy()
         out_path = f"{args.currency.lower()}_eur_fred_window_{res['window']}d.csv"
         df_used.to_csv(out_path, index_label="date")
         print(f"Dati usati salvati in: {out_path}")
@@ -3,9 +3,42 @@
 # Elaborato da ChatGPT-5
 
 import pandas as pd 
+import numpy as np
 import argparse
 import sys
-from typing import Tuple
+from typing import NamedTuple, Optional, Tuple
+
+# Colonne lette dal CSV: dati di performance e nomi comuni della colonna con l'importo investito
+VALUE_COLUMNS = ['TVPI', 'PaidIn', 'NAV', 'Distributions']
+INVESTED_COLUMNS = ['Investito', 'Invested', 'Amount', 'Importo']
+
+class ColumnPlan(NamedTuple):
+    """Colonne del CSV risolte una sola volta per la modalità scelta (None se assenti)."""
+    id_col: str
+    invested_col: Optional[str]
+    tvpi_col: Optional[str]
+    paidin_col: Optional[str]
+    nav_col: Optional[str]
+    distr_col: Optional[str]
+
+def _resolve_columns(df: pd.DataFrame, mode: str, id_col: str = 'Deal') -> ColumnPlan:
+    """
+    Risolve i nomi di colonna usati da build_shares e dall'output in un solo passaggio.
+    Per mode='invested' l'id ricade sulla prima colonna e l'importo, se nessun nome
+    noto è presente, sulla seconda; per le altre modalità l'id ricade su 'Deal'.
+    """
+    columns = set(df.columns)
+    present = lambda col: col if col in columns else None
+    invested_col = None
+    if mode == 'invested':
+        invested_col = next((col for col in INVESTED_COLUMNS if col in columns), None)
+        if invested_col is None and len(df.columns) >= 2:
+            invested_col = df.columns[1]
+        resolved_id = id_col if id_col in columns else df.columns[0]
+    else:
+        resolved_id = id_col if id_col in columns else 'Deal'
+    return ColumnPlan(resolved_id, invested_col, present('TVPI'), present('PaidIn'),
+                      present('NAV'), present('Distributions'))
 
 def compute_tvpi(df: pd.DataFrame) -> pd.Series:
     """
@@ -13,8 +46,10 @@ def compute_tvpi(df: pd.DataFrame) -> pd.Series:
     Richiede colonne: 'NAV' e 'Distributions' (facoltativa) e 'PaidIn'.
     TVPI = (NAV + Distributions) / PaidIn
     """
-    if 'TVPI' in df.columns and df['TVPI'].notna().all():
-        return df['TVPI'].astype(float)
+    if 'TVPI' in df.columns:
+        tvpi = df['TVPI'].to_numpy(dtype=np.float64)
+        if not np.isnan(tvpi).any():
+            return pd.Series(tvpi, index=df.index, name='TVPI')
 
     missing = [c for c in ['PaidIn', 'NAV'] if c not in df.columns]
     # Distributions può mancare; la assumiamo 0
@@ -23,18 +58,54 @@ def compute_tvpi(df: pd.DataFrame) -> pd.Series:
             "Per calcolare TVPI servono le colonne: PaidIn, NAV (e opzionale Distributions). "
             f"Mancano: {missing}"
         )
-    distr = df['Distributions'] if 'Distributions' in df.columns else 0.0
-    paidin = df['PaidIn'].astype(float)
-    nav = df['NAV'].astype(float)
+    distr = df['Distributions'].to_numpy(dtype=np.float64) if 'Distributions' in df.columns else 0.0
+    paidin = df['PaidIn'].to_numpy(dtype=np.float64)
+    nav = df['NAV'].to_numpy(dtype=np.float64)
 
     # Evita divisioni per zero
     if (paidin <= 0).any():
         raise ValueError("Sono presenti PaidIn <= 0, impossibile calcolare correttamente il TVPI.")
 
-    tvpi = (nav + distr.astype(float)) / paidin
-    return tvpi
-
-def build_shares(df: pd.DataFrame, mode: str) -> pd.Series:
+    return pd.Series((nav + distr) / paidin, index=df.index)
+
+def _weights_invested(df: pd.DataFrame, plan: ColumnPlan) -> np.ndarray:
+    # Modalità semplificata: importo investito (colonna nota o seconda colonna del CSV)
+    if plan.invested_col is None:
+        raise ValueError("Per mode='invested' serve almeno 2 colonne (nome società, importo investito).")
+    w = df[plan.invested_col].to_numpy(dtype=np.float64)
+    if (w < 0).any():
+        raise ValueError("Sono presenti importi investiti negativi.")
+    return w
+
+def _weights_tvpi(df: pd.DataFrame, plan: ColumnPlan) -> np.ndarray:
+    return compute_tvpi(df).to_numpy(dtype=np.float64)
+
+def _weights_value(df: pd.DataFrame, plan: ColumnPlan) -> np.ndarray:
+    tvpi = compute_tvpi(df).to_numpy(dtype=np.float64)
+    if plan.paidin_col is None:
+        raise ValueError("Per mode='value' serve la colonna PaidIn.")
+    return tvpi * df[plan.paidin_col].to_numpy(dtype=np.float64)  # == NAV + Distr
+
+def _weights_realized(df: pd.DataFrame, plan: ColumnPlan) -> np.ndarray:
+    if plan.distr_col is None:
+        raise ValueError("Per mode='realized' serve la colonna Distributions.")
+    return df[plan.distr_col].to_numpy(dtype=np.float64)
+
+def _weights_unrealized(df: pd.DataFrame, plan: ColumnPlan) -> np.ndarray:
+    if plan.nav_col is None:
+        raise ValueError("Per mode='unrealized' serve la colonna NAV.")
+    return df[plan.nav_col].to_numpy(dtype=np.float64)
+
+# Pesi grezzi per modalità: la scelta avviene con un solo lookup invece di una catena di if/elif
+_WEIGHT_BUILDERS = {
+    'tvpi': _weights_tvpi,
+    'value': _weights_value,
+    'realized': _weights_realized,
+    'unrealized': _weights_unrealized,
+    'invested': _weights_invested,
+}
+
+def build_shares(df: pd.DataFrame, mode: str, plan: Optional[ColumnPlan] = None) -> pd.Series:
     """
     Costruisce le quote s_i per l'HHI in base alla modalità scelta.
     mode:
@@ -43,56 +114,24 @@ def build_shares(df: pd.DataFrame, mode: str) -> pd.Series:
       - 'realized': s_i = (Distributions) / sum(Distributions)
       - 'unrealized': s_i = NAV / sum(NAV)
       - 'invested': s_i = Investito_i / sum(Investito) [per CSV semplificato con importi investiti]
+    plan: colonne già risolte con _resolve_columns (se None vengono risolte qui).
     """
-    if mode == 'invested':
-        # Modalità semplificata: usa direttamente la seconda colonna come importo investito
-        # Cerca colonne comuni per investimenti
-        invested_col = None
-        for col in ['Investito', 'Invested', 'Amount', 'Importo']:
-            if col in df.columns:
-                invested_col = col
-                break
-
-        if invested_col is None:
-            # Se non trova colonne note, usa la seconda colonna del DataFrame
-            if len(df.columns) >= 2:
-                invested_col = df.columns[1]
-            else:
-                raise ValueError("Per mode='invested' serve almeno 2 colonne (nome società, importo investito).")
-
-        w = df[invested_col].astype(float)
-        if (w < 0).any():
-            raise ValueError("Sono presenti importi investiti negativi.")
-    else:
-        # Modalità esistenti che richiedono TVPI
-        tvpi = compute_tvpi(df)
-
-        if mode == 'tvpi':
-            w = tvpi.astype(float)
-
-        elif mode == 'value':
-            if 'PaidIn' not in df.columns:
-                raise ValueError("Per mode='value' serve la colonna PaidIn.")
-            paidin = df['PaidIn'].astype(float)
-            w = tvpi * paidin  # == NAV + Distr
-
-        elif mode == 'realized':
-            if 'Distributions' not in df.columns:
-                raise ValueError("Per mode='realized' serve la colonna Distributions.")
-            w = df['Distributions'].astype(float)
-
-        elif mode == 'unrealized':
-            if 'NAV' not in df.columns:
-                raise ValueError("Per mode='unrealized' serve la colonna NAV.")
-            w = df['NAV'].astype(float)
-
-        else:
-            raise ValueError("mode non valido. Usa: tvpi, value, realized, unrealized, invested")
-
-    total = w.sum()
+    builder = _WEIGHT_BUILDERS.get(mode)
+    if builder is None:
+        raise ValueError("mode non valido. Usa: tvpi, value, realized, unrealized, invested")
+    if plan is None:
+        plan = _resolve_columns(df, mode)
+
+    # I pesi sono calcolati su array NumPy (una sola conversione per colonna) e riportati
+    # su df.index solo alla fine
+    w = builder(df, plan)
+
+    # Come la somma pandas, ignora i valori mancanti
+    total = np.nansum(w)
     if total <= 0:
         raise ValueError("La somma dei pesi è <= 0: non è possibile costruire le quote.")
-    shares = w / total
+    # Un solo reciproco e un prodotto vettoriale invece di n divisioni
+    shares = pd.Series(w * (1.0 / total), index=df.index)
     return shares
 
 def compute_hhi(shares: pd.Series) -> Tuple[float, float]:
@@ -101,7 +140,12 @@ def compute_hhi(shares: pd.Series) -> Tuple[float, float]:
     HHI = sum(s_i^2).
     HHI_normalizzato = (HHI - 1/N) / (1 - 1/N), scala 0..1 (0 = equidistribuzione, 1 = massima concentrazione).
     """
-    s2 = (shares ** 2).sum()
+    vals = shares.to_numpy(dtype=np.float64)
+    s2 = float(vals @ vals)
+    if np.isnan(s2):
+        # Quote mancanti (NaN): come nella somma pandas vengono ignorate
+        finite = vals[~np.isnan(vals)]
+        s2 = float(finite @ finite)
     n = shares.shape[0]
     if n <= 1:
         # con 1 solo elemento l'HHI è 1 e la normalizzazione non è definita (divide per 0)
@@ -109,17 +153,17 @@ def compute_hhi(shares: pd.Series) -> Tuple[float, float]:
     hhi_norm = (s2 - 1.0/n) / (1.0 - 1.0/n)
     return float(s2), float(hhi_norm)
 
+# Soglie di HHI normalizzato e relative classi di rischio (classe i per valori in [soglia i-1, soglia i))
+_HHI_EDGES = np.array([0.20, 0.40, 0.60, 0.80])
+_HHI_LABELS = np.array(["Basso", "Medio-Basso", "Medio", "Medio-Alto", "Alto"])
+
 def classify_hhi(hhi_norm: float) -> str:
-    if hhi_norm < 0.20:
-        return "Basso"
-    elif hhi_norm < 0.40:
-        return "Medio-Basso"
-    elif hhi_norm < 0.60:
-        return "Medio"
-    elif hhi_norm < 0.80:
-        return "Medio-Alto"
-    else:
-        return "Alto"
+    """
+    Classe di rischio per l'HHI normalizzato (accetta anche un array di valori).
+    Un valore NaN (HHI* non definito) ricade in "Alto".
+    """
+    labels = _HHI_LABELS[np.searchsorted(_HHI_EDGES, hhi_norm, side="right")]
+    return labels if np.ndim(labels) else str(labels)
 
 def main():
     parser = argparse.ArgumentParser(description="Calcolo HHI di concentrazione delle performance (TVPI) o investimenti.")
@@ -131,7 +175,20 @@ def main():
     args = parser.parse_args()
 
     try:
-        df = pd.read_csv(args.input_csv)
+        # Legge solo le colonne usate dallo script; le colonne d'importo (e le prime due, ripiego
+        # per id e importo) servono solo in mode='invested', dove sono lette già come float64
+        header = pd.read_csv(args.input_csv, nrows=0).columns
+        needed = {args.id_col, 'Deal', *VALUE_COLUMNS}
+        dtype = None
+        if args.mode == 'invested':
+            needed.update(INVESTED_COLUMNS, header[:2])
+            dtype = {col: np.float64 for col in INVESTED_COLUMNS if col in header}
+        df = pd.read_csv(
+            args.input_csv,
+            usecols=[col for col in header if col in needed],
+            dtype=dtype,
+            engine="c",
+        )
     except Exception as e:
         print(f"Errore nel leggere il CSV: {e}", file=sys.stderr)
         sys.exit(1)
@@ -141,9 +198,12 @@ def main():
                     "realized": ["Distributions"],
                     "unrealized": ["NAV"]}
 
+    # Colonne risolte una volta sola, riusate per le quote e per l'output
+    plan = _resolve_columns(df, args.mode, args.id_col)
+
     # Costruisci quote
     try:
-        shares = build_shares(df, args.mode)
+        shares = build_shares(df, args.mode, plan)
     except Exception as e:
         print(f"Errore nel calcolo quote: {e}", file=sys.stderr)
         sys.exit(2)
@@ -153,44 +213,44 @@ def main():
 
     # Costruisci output riassuntivo
     # Per mode='invested', usa la prima colonna come ID se id_col non è specificato
-    if args.mode == 'invested':
-        id_column = args.id_col if args.id_col in df.columns else df.columns[0]
-    else:
-        id_column = args.id_col if args.id_col in df.columns else "Deal"
+    id_column = plan.id_col
 
+    share_vals = shares.to_numpy(dtype=np.float64)
     out = pd.DataFrame({
         id_column: df[id_column] if id_column in df.columns else range(1, len(df)+1),
         "Share": shares,
-        "Share^2": shares**2
+        "Share^2": share_vals * share_vals
     })
 
     # Aggiungi colonne specifiche per mode='invested'
     if args.mode == 'invested':
-        # Trova la colonna investito
-        invested_col = None
-        for col in ['Investito', 'Invested', 'Amount', 'Importo']:
-            if col in df.columns:
-                invested_col = col
-                break
-        if invested_col is None and len(df.columns) >= 2:
-            invested_col = df.columns[1]
-
-        if invested_col:
-            out["Investito"] = df[invested_col].astype(float)
+        if plan.invested_col:
+            out["Investito"] = df[plan.invested_col].astype(float)
     else:
         # Aggiungi (se disponibili) colonne utili per le altre modalità
-        for col in ["TVPI","PaidIn","NAV","Distributions"]:
-            if col in df.columns:
+        for col in (plan.tvpi_col, plan.paidin_col, plan.nav_col, plan.distr_col):
+            if col is not None:
                 out[col] = df[col]
 
         # Contributo al valore totale (solo per mode='value')
         if args.mode == "value":
             # (= NAV + Distributions se Distributions presente, altrimenti NAV + 0)
-            distr = df['Distributions'] if 'Distributions' in df.columns else 0.0
-            out["ValueCreated"] = df["NAV"].astype(float) + distr.astype(float)
-
-    # Ordina per Share decrescente
-    out = out.sort_values(by="Share", ascending=False).reset_index(drop=True)
+            distr = df[plan.distr_col].astype(float) if plan.distr_col else 0.0
+            out["ValueCreated"] = df[plan.nav_col].astype(float) + distr
+
+    # Ordina per Share decrescente: l'ordinamento completo serve solo per il CSV di dettaglio,
+    # per le prime 10 righe basta una selezione parziale O(n)
+    # (ordinamento stabile: a parità di quota resta l'ordine del CSV di input)
+    top_n = 10
+    neg_shares = -out["Share"].to_numpy()
+    kth = np.partition(neg_shares, top_n - 1)[top_n - 1] if len(out) > 2 * top_n else np.nan
+    if args.output_csv or np.isnan(kth):
+        out = out.sort_values(by="Share", ascending=False, kind="stable").reset_index(drop=True)
+        top = out.head(top_n)
+    else:
+        # Righe con quota >= della decima più alta (pareggi inclusi), poi ordinamento di queste sole
+        candidates = out.iloc[np.flatnonzero(neg_shares <= kth)]
+        top = candidates.sort_values(by="Share", ascending=False, kind="stable").head(top_n)
 
     print("\n=== Herfindahl-Hirschman Index (HHI) sulla definizione di quota:", args.mode, "===")
     print(f"HHI        = {hhi:.6f}")
@@ -201,7 +261,7 @@ def main():
 
     # Mostra top 10 righe
     print("\nTop 10 contributi alle quote:")
-    print(out.head(10).to_string(index=False))
+    print(top.to_string(index=False))
     
     risk_level = classify_hhi(hhi_norm)
     print(f"Livello di rischio = {risk_level}")
@@ -4,11 +4,36 @@
 # Script per calcolare la media ponderata dei rating di rischio
 # Utilizzando una funzione logaritmica per amplificare i pesi   
 
+import sys
 import numpy as np
 
+N_RATINGS = 6
+
 def get_risk_ratings():
+    # Uso in batch: i rating arrivano da riga di comando o da stdin non interattivo, su una o più
+    # righe (es. "python weakest_link.py 3 4 5 2 1 6" oppure "echo 3 4 5 2 1 6 | python weakest_link.py");
+    # il prompt va su stderr per non sporcare l'output e si leggono righe finché non arrivano
+    # N_RATINGS valori (o EOF), senza attendere la chiusura dello stream
+    values = sys.argv[1:]
+    if not values and not sys.stdin.isatty():
+        print(f"Inserisci {N_RATINGS} rating separati da spazio:", file=sys.stderr, flush=True)
+        for line in sys.stdin:
+            values.extend(line.split())
+            if len(values) >= N_RATINGS:
+                break
+    if values:
+        try:
+            ratings = np.array(values, dtype=np.float64)
+        except ValueError:
+            ratings = np.array([np.nan])
+        if ratings.size != N_RATINGS or not np.isfinite(ratings).all():
+            print(f"Servono {N_RATINGS} rating numerici, ricevuto: {' '.join(values)}", file=sys.stderr)
+            sys.exit(1)
+        return ratings.tolist()
+
+    # Modalità interattiva
     ratings = []
-    for i in range(6):
+    for i in range(N_RATINGS):
         while True:
             try:
                 rating = float(input(f"Inserisci il rating di rischio {i + 1}: "))
@@ -19,21 +44,18 @@ def get_risk_ratings():
     return ratings
 
 def calculate_weights(ratings):
-    ratings = np.array(ratings)  # Convertire la lista in array NumPy
-    n = len(ratings)
-    base_weight = 1 / n
-    weights = np.full(n, base_weight)
+    ratings = np.asarray(ratings, dtype=np.float64)  # Convertire la lista in array NumPy
 
     # Amplificare i pesi basati sui rating usando una funzione logaritmica
-    max_rating = np.max(ratings)
-    amplified_weights = weights * (1 + np.log1p(ratings / max_rating))
+    # (il peso base uniforme 1/n si semplifica nella normalizzazione)
+    weights = 1.0 + np.log1p(ratings / ratings.max())
 
     # Normalizzare i pesi
-    normalized_weights = amplified_weights / np.sum(amplified_weights)
-    return normalized_weights
+    weights /= weights.sum()
+    return weights
 
 def calculate_weighted_average(ratings, weights):
-    weighted_average = np.sum(ratings * weights)
+    weighted_average = float(np.dot(ratings, weights))
     return weighted_average
 
 def main():